@@ -1,6 +1,7 @@
 CRLF = "\r\n"
 
 REQUEST_LINE_MATCHER = r"(?P<method>GET|POST) (?P<resource>/[\w./-]*)"
+SUPPORTED_VERSIONS = ("HTTP/1.0", "HTTP/1.1")
 PATH_PARAM_MATCHER = r"\{(?P<path_param>\w+)\}"
 
 
@@ -1,11 +1,14 @@
 import argparse
 from dataclasses import dataclass
 import gzip
+import os
 import re
 import socket
 import threading
-from typing import Literal, cast
-from app import constants, request, response, router, utils
+import time
+import traceback
+from typing import Callable, Literal, cast
+from app import constants, metrics, request, response, router, utils, workers
 
 
 app = router.Router()
@@ -19,6 +22,8 @@ def echo(request: request.Request):
 
     available_encoding = set(request.env.available_encoding)
     intersection = accept_encoding.intersection(available_encoding)
+    # Content-Length counts bytes, not characters
+    body = request.params.get("path_param", "").encode()
 
     if not bool(intersection):
         return response.Response(
@@ -26,12 +31,12 @@ def echo(request: request.Request):
             "OK",
             header=response.Header(
                 content_type="text/plain",
-                content_length=len(request.params.get("path_param", "")),
+                content_length=len(body),
             ),
-            body=request.params.get("path_param", ""),
+            body=body,
         )
 
-    compressed = gzip.compress(request.params.get("path_param", "").encode())
+    compressed = gzip.compress(body)
     return response.Response(
         200,
         "OK",
@@ -46,15 +51,15 @@ def echo(request: request.Request):
 
 @app.get(r"^/user-agent$")
 def user_agent_echo(request: request.Request):
+    user_agent = request.header.user_agent or "" if request.header else ""
+    body = user_agent.encode()
     return response.Response(
         200,
         "OK",
-        body=request.header.user_agent if request.header else None,
+        body=body,
         header=response.Header(
             content_type="text/plain",
-            content_length=len(
-                request.header.user_agent or "" if request.header else ""
-            ),
+            content_length=len(body),
         ),
     )
 
@@ -66,14 +71,15 @@ def get_file(request: request.Request):
     if file_path is None:
         return response.Response(404, "Not Found")
     file_path = f"{request.env.directory}/{file_path}"
-    file = utils.get_file_at_path(file_path)
+    file = utils.iter_file_at_path(file_path)
     if file is None:
         return response.Response(404, "Not Found")
+    size, chunks = file
     return response.Response(
         200,
         "OK",
-        header=response.Header(constants.ContentType.octet_stream, len(file)),
-        body=file.decode(),
+        header=response.Header(constants.ContentType.octet_stream, size),
+        body=chunks,
     )
 
 
@@ -92,64 +98,318 @@ def create_file(request: request.Request):
     return response.Response(201, "Created")
 
 
+def metrics_endpoint(request: request.Request):
+    body = metrics.registry.render()
+    return response.Response(
+        200,
+        "OK",
+        header=response.Header("text/plain; version=0.0.4", len(body)),
+        body=body,
+    )
+
+
 @dataclass
 class Env:
     directory: str | None
     available_encoding: list[str]
+    max_body_size: int | None = None
+    # seconds, None waits forever
+    header_timeout: float | None = 10.0
+    body_timeout: float | None = 30.0
+    keep_alive_timeout: float | None = 5.0
+    write_timeout: float | None = 30.0
+    max_connections: int = 1024
+
+
+HOST = "localhost"
+PORT = 4221
+ACCEPT_POLL_INTERVAL = 0.5
+# how long we try to tell a client why it is being dropped
+REJECT_TIMEOUT = 1.0
 
 
 def main():
-    directory = get_directory_arg()
+    args = get_args()
+    env = Env(
+        directory=args.directory,
+        available_encoding=["gzip"],
+        max_body_size=args.max_body_size,
+        header_timeout=args.header_timeout,
+        body_timeout=args.body_timeout,
+        keep_alive_timeout=args.keep_alive_timeout,
+        write_timeout=args.write_timeout,
+        max_connections=args.max_connections,
+    )
+    if args.metrics:
+        metrics.registry.enabled = True
+        app.add_route(r"^/metrics$", "GET", metrics_endpoint)
+
+    if args.workers > 1:
+        workers.Supervisor(
+            args.workers,
+            lambda stopping, ready: serve(HOST, PORT, env, stopping, ready),
+            graceful_timeout=args.graceful_timeout,
+        ).run()
+        return
 
-    host = "localhost"
-    port = 4221
+    try:
+        serve(HOST, PORT, env)
+    except KeyboardInterrupt:
+        print("\nShutting down server")
+
+
+def serve(
+    host: str,
+    port: int,
+    env: Env,
+    stopping: threading.Event | None = None,
+    ready: Callable[[], None] | None = None,
+):
+    """
+    Accepts connections until `stopping` is set, then stops listening and
+    waits for the connections it already accepted to finish.
+    """
+    stopping = stopping or threading.Event()
+    # every worker binds its own socket, the kernel spreads connections
+    # across them thanks to SO_REUSEPORT
     server_socket = socket.create_server((host, port), reuse_port=True)
-    print(f"Server listening on {host}:{port}...")
+    server_socket.settimeout(ACCEPT_POLL_INTERVAL)
+    print(f"Server {os.getpid()} listening on {host}:{port}...")
+    if ready:
+        ready()
+
+    client_threads: list[threading.Thread] = []
+    # admission control, past the cap clients get a 503 straight from the
+    # accept loop instead of a thread
+    slots = threading.BoundedSemaphore(env.max_connections)
+
+    def run(conn: socket.socket):
+        try:
+            handle_connection(conn, env, stopping)
+        finally:
+            slots.release()
+
+    def turn_away(conn: socket.socket):
+        reject(conn, response.Response(503, "Service Unavailable", close=True), 0)
+        conn.close()
+
+    def start(conn: socket.socket):
+        if not slots.acquire(blocking=False):
+            turn_away(conn)
+            return
+        client_thread = threading.Thread(target=run, args=(conn,))
+        try:
+            client_thread.start()
+        except RuntimeError:
+            # out of threads, treat it like being over the connection cap
+            slots.release()
+            turn_away(conn)
+            return
+        client_threads[:] = [t for t in client_threads if t.is_alive()]
+        client_threads.append(client_thread)
+
+    try:
+        while not stopping.is_set():
+            try:
+                conn, _ = server_socket.accept()  # wait for client
+            except TimeoutError:
+                continue
+            start(conn)
+        # take whatever already sits in the backlog before closing the socket,
+        # closing it would reset those connections
+        server_socket.setblocking(False)
+        while True:
+            try:
+                conn, _ = server_socket.accept()
+            except BlockingIOError:
+                break
+            conn.setblocking(True)
+            start(conn)
+    finally:
+        server_socket.close()
+    for client_thread in client_threads:
+        client_thread.join()
+
+
+def reject(conn: socket.socket, res: response.Response, timeout: float = REJECT_TIMEOUT):
+    """Best effort error response to a client that is about to be dropped."""
+    try:
+        conn.settimeout(timeout)
+        res.send(conn)
+    except OSError:
+        pass
+
+
+def handle_connection(
+    conn: socket.socket, env: Env, stopping: threading.Event | None = None
+):
+    buffered = b""
+    # a fresh connection has to send its whole head within the header timeout
+    # of being accepted, later ones may idle between requests for the
+    # keep-alive timeout and then get the header timeout from the first byte
+    idle_timeout = env.header_timeout
+    deadline = (
+        time.monotonic() + env.header_timeout
+        if env.header_timeout is not None
+        else None
+    )
     try:
         while True:
-            conn, _ = server_socket.accept()  # wait for client
-            client_thread = threading.Thread(
-                target=handle_connection,
-                args=(
+            try:
+                message = request.read_head(
+                    conn, buffered, idle_timeout, env.header_timeout, deadline
+                )
+            except request.MalformedRequest:
+                reject(conn, response.Response(400, "Bad Request", close=True))
+                return
+            except TimeoutError:
+                reject(conn, response.Response(408, "Request Timeout", close=True))
+                return
+            if message is None:
+                return
+            start = time.perf_counter()
+            head, buffered = message
+            msg_req = head.split(constants.CRLF)
+            request_line = msg_req[0]
+            try:
+                method, _, version = request.parse_request_line(request_line)
+            except request.UnsupportedVersion:
+                reject(
+                    conn,
+                    response.Response(505, "HTTP Version Not Supported", close=True),
+                )
+                return
+            except request.MalformedRequest:
+                reject(conn, response.Response(400, "Bad Request", close=True))
+                return
+            match = re.search(constants.REQUEST_LINE_MATCHER, request_line)
+            if not match:
+                if method not in ("GET", "POST"):
+                    res = response.Response(501, "Not Implemented", close=True)
+                else:
+                    res = response.Response(400, "Bad Request", close=True)
+                reject(conn, res)
+                return
+            grouped = match.groupdict()
+            headers_line = msg_req[1:]
+            try:
+                header = request.Header.from_list(headers_line)
+            except request.MalformedRequest:
+                reject(conn, response.Response(400, "Bad Request", close=True))
+                return
+            req = request.Request(
+                resource=grouped.get("resource", ""),
+                method=cast(Literal["GET", "POST"], grouped.get("method", "")),  # type: ignore
+                env=env,
+                header=header,
+                body=request.BodyStream.from_header(
                     conn,
-                    Env(directory=directory, available_encoding=["gzip"]),
+                    buffered,
+                    header,
+                    max_size=env.max_body_size,
+                    timeout=env.body_timeout,
                 ),
+                version=version,
             )
-            client_thread.start()
-    except KeyboardInterrupt:
-        print("\nShutting down server")
+            req.timings["parse"] = time.perf_counter() - start
+            keep_alive = req.keep_alive and not (stopping and stopping.is_set())
+            try:
+                res = app.run(req)
+            except request.BodyTooLarge:
+                res = response.Response(413, "Payload Too Large")
+                keep_alive = False
+            except request.MalformedRequest:
+                res = response.Response(400, "Bad Request")
+                keep_alive = False
+            except TimeoutError:
+                res = response.Response(408, "Request Timeout")
+                keep_alive = False
+            except Exception:
+                traceback.print_exc()
+                res = response.Response(500, "Internal Server Error")
+                keep_alive = False
+            res.close = not keep_alive
+            res.chunked = req.version != "HTTP/1.0"
+            written = time.perf_counter()
+            conn.settimeout(env.write_timeout)
+            res.send(conn)
+            req.timings["write"] = time.perf_counter() - written
+            metrics.registry.record(req.route or "error", res.status, req.timings)
+            # send may have decided to end the body by closing the connection
+            if res.close:
+                return
+            try:
+                buffered = req.body.finish()  # type: ignore
+            except (request.BodyTooLarge, request.MalformedRequest):
+                return
+            idle_timeout = env.keep_alive_timeout
+            deadline = None
+    except OSError:
+        # the client went away, timed out mid response or reset the connection
+        pass
+    except Exception:
+        traceback.print_exc()
+    finally:
+        conn.close()
 
 
-def handle_connection(conn: socket.socket, env: Env):
-    message = conn.recv(1024).decode()
-    message_parts = message.split(constants.CRLF * 2)
-    assert len(message_parts) > 0
-    msg_req = message_parts[0].split(constants.CRLF)
-    msg_body = utils.get(message_parts, 1)  # noqa: F841
-    request_line = msg_req[0]
-    match = re.search(constants.REQUEST_LINE_MATCHER, request_line)
-    if match:
-        grouped = match.groupdict()
-        headers_line = msg_req[1:]
-        req = request.Request(
-            resource=grouped.get("resource", ""),
-            method=cast(Literal["GET", "POST"], grouped.get("method", "")),  # type: ignore
-            env=env,
-            header=request.Header.from_list(headers_line),
-            body=msg_body,
-        )
-        res = app.run(req)
-    else:
-        res = response.response_builder(500, "Server Error").encode()
-    conn.sendall(res)
-    conn.close()
-
-
-def get_directory_arg():
+def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--directory")
-    args = parser.parse_args()
-    return args.directory
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of pre-forked worker processes, SIGHUP reloads them",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=30.0,
+        help="seconds old workers get to finish their connections on reload",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="record per-route counters and latencies and serve them on /metrics",
+    )
+    parser.add_argument(
+        "--header-timeout",
+        type=float,
+        default=10.0,
+        help="seconds a client gets to send the request line and headers",
+    )
+    parser.add_argument(
+        "--body-timeout",
+        type=float,
+        default=30.0,
+        help="seconds a client gets to send each 64 KiB of the request body",
+    )
+    parser.add_argument(
+        "--keep-alive-timeout",
+        type=float,
+        default=5.0,
+        help="seconds an idle keep-alive connection is kept open",
+    )
+    parser.add_argument(
+        "--write-timeout",
+        type=float,
+        default=30.0,
+        help="seconds a client gets to accept each write of the response",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=1024,
+        help="open connections per process, further clients get a 503",
+    )
+    parser.add_argument(
+        "--max-body-size",
+        type=int,
+        default=None,
+        help="reject request bodies larger than this many bytes",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
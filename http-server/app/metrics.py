@@ -0,0 +1,101 @@
+import os
+import threading
+from bisect import bisect_left
+
+
+PHASES = ("parse", "dispatch", "handler", "write")
+# latency bucket upper bounds in seconds, the last one catches everything
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    float("inf"),
+)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class RouteMetrics:
+    __slots__ = ("statuses", "phases")
+
+    def __init__(self):
+        self.statuses: dict[int, int] = {}
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+
+class Metrics:
+    """
+    Per-route request counters and per-phase latency histograms.
+
+    Recording takes one lock per request and does nothing unless `enabled`.
+    With --workers every process keeps its own numbers.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.routes: dict[str, RouteMetrics] = {}
+
+    def record(self, route: str, status: int, timings: dict[str, float]):
+        if not self.enabled:
+            return
+        with self.lock:
+            metrics = self.routes.get(route)
+            if metrics is None:
+                metrics = self.routes[route] = RouteMetrics()
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            for phase, seconds in timings.items():
+                metrics.phases[phase].observe(seconds)
+
+    def render(self):
+        """Prometheus text exposition format, each metric as one group."""
+        pid = os.getpid()
+        requests = ["# TYPE http_requests_total counter"]
+        phases = ["# TYPE http_phase_seconds histogram"]
+        with self.lock:
+            for route, metrics in sorted(self.routes.items()):
+                for status, count in sorted(metrics.statuses.items()):
+                    requests.append(
+                        f'http_requests_total{{pid="{pid}",route="{route}",status="{status}"}} {count}'
+                    )
+                for phase, histogram in metrics.phases.items():
+                    if not histogram.count:
+                        continue
+                    labels = f'pid="{pid}",route="{route}",phase="{phase}"'
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else bound
+                        phases.append(
+                            f'http_phase_seconds_bucket{{{labels},le="{le}"}} {cumulative}'
+                        )
+                    phases.append(f"http_phase_seconds_sum{{{labels}}} {histogram.total}")
+                    phases.append(f"http_phase_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(requests + phases) + "\n"
+
+
+registry = Metrics()
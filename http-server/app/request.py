@@ -1,37 +1,277 @@
+import socket
+import time
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, Iterator, Literal
 from app import constants, utils
 
 if TYPE_CHECKING:
     from main import Env
 
 
+CHUNK_SIZE = 64 * 1024
+MAX_HEAD_SIZE = 16 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class MalformedRequest(Exception):
+    pass
+
+
+class UnsupportedVersion(MalformedRequest):
+    pass
+
+
 def extract_request_parts(message: str):
     parts = message.split(constants.CRLF)
     return (utils.get(parts, 0), utils.get(parts, 1))
 
 
+def parse_request_line(line: str):
+    """Splits the request line into its method, target and HTTP version."""
+    parts = line.split(" ")
+    if len(parts) != 3:
+        raise MalformedRequest(
+            f"request line must be <method> <target> <version> got {line}"
+        )
+    method, target, version = parts
+    if version not in constants.SUPPORTED_VERSIONS:
+        raise UnsupportedVersion(f"unsupported HTTP version {version}")
+    return method, target, version
+
+
+def read_head(
+    conn: socket.socket,
+    buffered: bytes = b"",
+    idle_timeout: float | None = None,
+    header_timeout: float | None = None,
+    deadline: float | None = None,
+    max_size: int = MAX_HEAD_SIZE,
+):
+    """
+    Reads from the socket up to the blank line ending the headers, starting
+    with whatever a previous request on the connection left `buffered`.
+    Returns the decoded head and whatever part of the body came along with it,
+    or None if the client closed the connection or stayed silent for
+    `idle_timeout` before sending anything. Once the first byte is in, the
+    whole head has to arrive within `header_timeout`, unless the caller
+    already fixed a `deadline`.
+    """
+    buffer = bytearray(buffered)
+    delimiter = (constants.CRLF * 2).encode()
+    while True:
+        end = buffer.find(delimiter)
+        if end != -1:
+            try:
+                head = buffer[:end].decode()
+            except UnicodeDecodeError:
+                raise MalformedRequest("request head is not valid UTF-8")
+            return head, bytes(buffer[end + len(delimiter) :])
+        if len(buffer) > max_size:
+            raise MalformedRequest("request head too large")
+        if buffer and deadline is None and header_timeout is not None:
+            deadline = time.monotonic() + header_timeout
+        if deadline is None:
+            conn.settimeout(idle_timeout)
+        else:
+            conn.settimeout(max(deadline - time.monotonic(), 0.001))
+        try:
+            data = conn.recv(4096)
+        except TimeoutError:
+            if not buffer:
+                return None
+            raise
+        if not data:
+            if not buffer:
+                return None
+            raise MalformedRequest("connection closed before end of headers")
+        buffer += data
+
+
 @dataclass
 class Header:
     host: str | None
     user_agent: str | None
     accept_encoding: str | None
+    content_length: int | None = None
+    transfer_encoding: str | None = None
+    connection: str | None = None
 
     @classmethod
     def from_list(cls, data: list[str]):
         headers: dict[str, str] = {}
         for d in data:
             split_header_line = d.split(r": ")
-            assert (
-                len(split_header_line) == 2
-            ), f"headers must be in <key>:<value> format got {d}"
+            if len(split_header_line) != 2:
+                raise MalformedRequest(
+                    f"headers must be in <key>:<value> format got {d}"
+                )
             key, value = split_header_line
-            headers[key] = value
+            # header names are case-insensitive
+            headers[key.lower()] = value
+        content_length = headers.get("content-length")
+        if content_length is not None and not (
+            content_length.isascii() and content_length.isdigit()
+        ):
+            raise MalformedRequest(f"invalid Content-Length {content_length}")
+        transfer_encoding = headers.get("transfer-encoding")
+        if transfer_encoding is not None:
+            if content_length is not None:
+                raise MalformedRequest(
+                    "Content-Length and Transfer-Encoding must not both be set"
+                )
+            if not is_chunked(transfer_encoding):
+                raise MalformedRequest(
+                    f"unsupported Transfer-Encoding {transfer_encoding}"
+                )
         return cls(
-            host=headers.get("Host"),
-            user_agent=headers.get("User-Agent"),
-            accept_encoding=headers.get("Accept-Encoding"),
+            host=headers.get("host"),
+            user_agent=headers.get("user-agent"),
+            accept_encoding=headers.get("accept-encoding"),
+            content_length=int(content_length) if content_length else None,
+            transfer_encoding=transfer_encoding,
+            connection=headers.get("connection"),
+        )
+
+
+def is_chunked(transfer_encoding: str):
+    """Whether chunked is the final coding, which is what frames the body."""
+    codings = [coding.strip().lower() for coding in transfer_encoding.split(",")]
+    return codings[-1] == "chunked"
+
+
+class BodyStream:
+    """
+    Request body that is read off the socket lazily, CHUNK_SIZE bytes at a time.
+    Handles both `Content-Length` and `Transfer-Encoding: chunked` bodies.
+
+    With a `timeout` the client has that many seconds to deliver each
+    CHUNK_SIZE worth of body, which keeps large uploads working while a client
+    trickling a few bytes at a time is cut off.
+    """
+
+    def __init__(
+        self,
+        conn: socket.socket,
+        buffered: bytes,
+        content_length: int | None = None,
+        chunked: bool = False,
+        max_size: int | None = None,
+        timeout: float | None = None,
+    ):
+        self.conn = conn
+        self.buffer = bytearray(buffered)
+        self.content_length = content_length
+        self.chunked = chunked
+        self.max_size = max_size
+        self.received = 0
+        self.chunks: Iterator[bytes] | None = None
+        self.timeout = timeout
+        self.deadline: float | None = None
+        self.window = 0
+
+    @classmethod
+    def from_header(
+        cls,
+        conn: socket.socket,
+        buffered: bytes,
+        header: Header,
+        max_size: int | None = None,
+        timeout: float | None = None,
+    ):
+        chunked = header.transfer_encoding is not None and is_chunked(
+            header.transfer_encoding
         )
+        return cls(conn, buffered, header.content_length, chunked, max_size, timeout)
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self.chunks is None:
+            self.chunks = self._iter_chunked() if self.chunked else self._iter_sized()
+        return self.chunks
+
+    def read(self) -> bytes:
+        return b"".join(self)
+
+    def finish(self) -> bytes:
+        """
+        Discards whatever the handler left unread and returns the bytes after
+        the body, which belong to the next request on the connection.
+        """
+        for _ in self:
+            pass
+        return bytes(self.buffer)
+
+    def _recv(self):
+        if self.timeout is not None:
+            if self.deadline is None or self.window >= CHUNK_SIZE:
+                self.deadline = time.monotonic() + self.timeout
+                self.window = 0
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("request body not received in time")
+            self.conn.settimeout(remaining)
+        else:
+            # don't inherit whatever deadline read_head left on the socket
+            self.conn.settimeout(None)
+        data = self.conn.recv(CHUNK_SIZE)
+        self.window += len(data)
+        if not data:
+            raise MalformedRequest("connection closed before end of body")
+        self.buffer += data
+
+    def _take(self, size: int) -> bytes:
+        """Pops up to `size` bytes, receiving more only if nothing is buffered."""
+        if not self.buffer:
+            self._recv()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self._count(len(data))
+        return data
+
+    def _readline(self) -> bytes:
+        delimiter = constants.CRLF.encode()
+        while (end := self.buffer.find(delimiter)) == -1:
+            if len(self.buffer) > MAX_HEAD_SIZE:
+                raise MalformedRequest("chunk size line too long")
+            self._recv()
+        line = bytes(self.buffer[:end])
+        del self.buffer[: end + len(delimiter)]
+        return line
+
+    def _count(self, size: int):
+        self.received += size
+        if self.max_size is not None and self.received > self.max_size:
+            raise BodyTooLarge(f"body exceeds {self.max_size} bytes")
+
+    def _iter_sized(self):
+        remaining = self.content_length or 0
+        if self.max_size is not None and remaining > self.max_size:
+            raise BodyTooLarge(f"body exceeds {self.max_size} bytes")
+        while remaining > 0:
+            data = self._take(min(remaining, CHUNK_SIZE))
+            remaining -= len(data)
+            yield data
+
+    def _iter_chunked(self):
+        while True:
+            size_line = self._readline().split(b";", 1)[0].strip()
+            try:
+                remaining = int(size_line, 16)
+            except ValueError:
+                raise MalformedRequest(f"invalid chunk size {size_line!r}")
+            if remaining == 0:
+                # skip trailers up to the terminating blank line
+                while self._readline():
+                    pass
+                return
+            while remaining > 0:
+                data = self._take(min(remaining, CHUNK_SIZE))
+                remaining -= len(data)
+                yield data
+            if self._readline():
+                raise MalformedRequest("chunk data not followed by CRLF")
 
 
 @dataclass
@@ -41,4 +281,15 @@ class Request:
     env: "Env"
     params: dict[str, str] = field(default_factory=dict)
     header: Header | None = None
-    body: str | None = None
+    body: BodyStream | None = None
+    version: str = "HTTP/1.1"
+    # name of the handler that served the request and seconds spent per phase
+    route: str | None = None
+    timings: dict[str, float] = field(default_factory=dict[str, float])
+
+    @property
+    def keep_alive(self):
+        connection = (self.header.connection or "") if self.header else ""
+        if self.version == "HTTP/1.0":
+            return connection.lower() == "keep-alive"
+        return connection.lower() != "close"
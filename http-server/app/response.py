@@ -1,39 +1,64 @@
-from dataclasses import dataclass
-from app import constants
+import socket
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from http import HTTPStatus
+from typing import AsyncIterable, Iterable, cast
+from app import constants, utils
+
+
+CRLF = constants.CRLF.encode()
+CONNECTION_CLOSE = b"Connection: close" + CRLF
+LAST_CHUNK = b"0" + CRLF + CRLF
+
+# status lines are the same for every response with a given status, so they
+# are encoded once up front instead of formatted on every request
+STATUS_LINES: dict[tuple[int, str], bytes] = {
+    (status.value, status.phrase): f"HTTP/1.1 {status.value} {status.phrase}{constants.CRLF}".encode()
+    for status in HTTPStatus
+}
+
+
+@lru_cache(maxsize=64)
+def _encode_status_line(version: str, status: int, reason_phrase: str):
+    return f"{version} {status} {reason_phrase}{constants.CRLF}".encode()
+
+
+def status_line(status: int, reason_phrase: str, version: str = "HTTP/1.1"):
+    if version == "HTTP/1.1":
+        line = STATUS_LINES.get((status, reason_phrase))
+        if line is not None:
+            return line
+    return _encode_status_line(version, status, reason_phrase)
 
 
 @dataclass
 class Header:
     content_type: str
-    content_length: int
+    content_length: int | None = None
     content_encoding: str | None = None
+    transfer_encoding: str | None = None
+    extra: dict[str, str] = field(default_factory=dict[str, str])
 
     def dict(self):
-        base = {
-            "Content-Type": self.content_type,
-            "Content-Length": self.content_length,
-        }
+        base: dict[str, str | int] = {"Content-Type": self.content_type}
+        if self.content_length is not None:
+            base["Content-Length"] = self.content_length
         if self.content_encoding:
             base["Content-Encoding"] = self.content_encoding
+        if self.transfer_encoding:
+            base["Transfer-Encoding"] = self.transfer_encoding
+        base.update(self.extra)
         return base
 
-    def headers(self):
-        return constants.CRLF.join(
-            [f"{key}: {value}" for key, value in self.dict().items()]
-        )
+    def serialize(self):
+        """Header block as bytes, each line terminated by CRLF."""
+        return "".join(
+            [f"{key}: {value}{constants.CRLF}" for key, value in self.dict().items()]
+        ).encode("latin-1")
 
 
-def response_builder(
-    status: int,
-    reason_phrase: str,
-    header: Header | None = None,
-    body: str | None = None,
-    version: str = "HTTP/1.1",
-):
-    res = f"{version} {status} {reason_phrase}{constants.CRLF}{header.headers() if header else ''}{constants.CRLF}{constants.CRLF}"
-    if body:
-        res += f"{body}"
-    return res
+def chunk_size_line(chunk: bytes):
+    return b"%x\r\n" % len(chunk)
 
 
 @dataclass
@@ -41,13 +66,87 @@ class Response:
     status: int
     reason_phrase: str
     header: Header | None = None
-    body: str | bytes | None = None
+    body: str | bytes | Iterable[bytes] | AsyncIterable[bytes] | None = None
     version: str = "HTTP/1.1"
+    # tells the client the connection is closed after this response
+    close: bool = False
+    # HTTP/1.0 clients cannot decode chunked bodies, for them a streamed body
+    # without a length is sent as is and ended by closing the connection
+    chunked: bool = True
 
-    def build(self):
-        res = f"{self.version} {self.status} {self.reason_phrase}{constants.CRLF}{self.header.headers() if self.header else ''}{constants.CRLF}{constants.CRLF}"
+    @property
+    def streaming(self):
+        return self.body is not None and not isinstance(self.body, (str, bytes))
+
+    def head(self, header: Header | None = None):
+        header = header or self.header
+        return b"".join(
+            [
+                status_line(self.status, self.reason_phrase, self.version),
+                header.serialize() if header else b"",
+                CONNECTION_CLOSE if self.close else b"",
+                CRLF,
+            ]
+        )
+
+    def buffers(self) -> list[bytes]:
+        """
+        Head and body as separate buffers, ready for a scatter-gather write.
+        A missing Content-Length is filled in from the encoded body.
+        """
         if type(self.body) is str:
-            res += f"{self.body}"
-        if type(self.body) is bytes:
-            return b"".join([res.encode(), self.body])
-        return res.encode()
+            body = self.body.encode()
+        elif type(self.body) is bytes:
+            body = self.body
+        else:
+            body = b""
+        if self.header is None:
+            # without a length the client could only find the end of the body
+            # by the connection closing, which rules out keep-alive
+            return [
+                status_line(self.status, self.reason_phrase, self.version),
+                b"Content-Length: %d\r\n" % len(body),
+                CONNECTION_CLOSE + CRLF if self.close else CRLF,
+                body,
+            ]
+        if self.header.content_length is None:
+            return [self.head(replace(self.header, content_length=len(body))), body]
+        return [self.head(), body]
+
+    def build(self):
+        return b"".join(self.buffers())
+
+    def send(self, conn: socket.socket):
+        """
+        Writes the response to `conn`. Iterator and async iterator bodies are
+        pulled one chunk at a time and only after the previous chunk was handed
+        to the kernel, so a slow reader slows the producer down instead of
+        piling data up in memory.
+        """
+        if not self.streaming:
+            utils.send_buffers(conn, self.buffers())
+            return
+
+        header = self.header or Header(constants.ContentType.octet_stream)
+        chunked = header.content_length is None and self.chunked
+        if chunked:
+            header = replace(header, transfer_encoding="chunked")
+        elif header.content_length is None:
+            self.close = True
+        utils.send_buffers(conn, [self.head(header)])
+
+        if isinstance(self.body, AsyncIterable):
+            chunks = utils.iter_async(self.body)
+        else:
+            chunks = iter(cast(Iterable[bytes | str], self.body))
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if not chunk:
+                continue
+            if chunked:
+                utils.send_buffers(conn, [chunk_size_line(chunk), chunk, CRLF])
+            else:
+                utils.send_buffers(conn, [chunk])
+        if chunked:
+            utils.send_buffers(conn, [LAST_CHUNK])
@@ -1,4 +1,5 @@
 import re
+import time
 from typing import Callable, Literal
 from app import request, response
 
@@ -38,7 +39,8 @@ class Router:
 
         return decorator
 
-    def run(self, request: request.Request) -> bytes:
+    def run(self, request: request.Request) -> response.Response:
+        start = time.perf_counter()
         for path, (method, handler) in self.route_map.items():
             if request.method != method:
                 continue
@@ -47,6 +49,13 @@ class Router:
             if match:
                 # pprint({"matched": match.groupdict(), "path": path})
                 request.params = match.groupdict()
-                return handler(request).build()
+                request.route = handler.__name__
+                matched = time.perf_counter()
+                request.timings["dispatch"] = matched - start
+                res = handler(request)
+                request.timings["handler"] = time.perf_counter() - matched
+                return res
         # none path matched
-        return response.response_builder(404, "Not Found").encode()
+        request.route = "not_found"
+        request.timings["dispatch"] = time.perf_counter() - start
+        return response.Response(404, "Not Found")
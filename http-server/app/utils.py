@@ -1,4 +1,8 @@
-from typing import TypeVar
+import asyncio
+import os
+import socket
+import tempfile
+from typing import AsyncIterable, Iterable, Iterator, TypeVar
 
 T = TypeVar("T")
 
@@ -10,21 +14,90 @@ def get(arr: list[T], index: int) -> T | None:
         return None
 
 
-def get_file_at_path(
-    path: str,
-):
+def iter_file_at_path(path: str, chunk_size: int = 64 * 1024):
+    """
+    Opens the file eagerly so a missing file is reported up front, then returns
+    its size and a generator yielding its contents `chunk_size` bytes at a time.
+    """
     try:
-        with open(path, "rb") as f:
-            return f.read()
+        f = open(path, "rb")
     except FileNotFoundError:
         print("The file was not found.")
+        return None
     except IOError:
         print("An error occurred while reading the file.")
+        return None
+
+    def chunks():
+        with f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    return os.fstat(f.fileno()).st_size, chunks()
+
+
+def iter_async(chunks: AsyncIterable[T]) -> Iterator[T]:
+    """Drives an async iterator from synchronous code on a private event loop."""
+    loop = asyncio.new_event_loop()
+    iterator = aiter(chunks)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(iterator))  # type: ignore
+            except StopAsyncIteration:
+                return
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            loop.run_until_complete(aclose())
+        loop.close()
+
+
+# below this size copying the buffers together is cheaper than a sendmsg call
+SMALL_WRITE = 16 * 1024
+
+
+def send_buffers(conn: socket.socket, buffers: list[bytes]):
+    """
+    Writes all `buffers` to `conn`. Large writes go out through `sendmsg`
+    (writev) so the body is never copied into a joined buffer.
+    """
+    total = sum(map(len, buffers))
+    if total <= SMALL_WRITE or not hasattr(conn, "sendmsg"):
+        conn.sendall(b"".join(buffers))
+        return
+    sent = conn.sendmsg(buffers)
+    if sent == total:
+        return
+    # partial write: drop whatever went out and slice into the rest
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        while views and sent >= views[0].nbytes:
+            sent -= views[0].nbytes
+            views.pop(0)
+        if not views:
+            return
+        views[0] = views[0][sent:]
+        sent = conn.sendmsg(views)
 
 
 def create_file_at_path(
     path: str,
-    content: str,
+    chunks: Iterable[bytes],
 ):
-    with open(path, "w") as f:
-        f.write(content)
+    """
+    Writes `chunks` to a temporary file next to `path` and renames it into place
+    once everything was written, so readers never see a partial file.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=".upload-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
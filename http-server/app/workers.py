@@ -0,0 +1,172 @@
+import os
+import select
+import signal
+import sys
+import threading
+import time
+from typing import Callable
+
+
+POLL_INTERVAL = 0.2
+READY_TIMEOUT = 10.0
+# minimum time between replacing crashed workers, so a worker that cannot
+# start does not turn into a fork loop
+RESTART_DELAY = 1.0
+
+# a worker runs the server until `stopping` is set and calls `ready` once it
+# is listening
+Worker = Callable[[threading.Event, Callable[[], None]], None]
+
+
+def run_worker(target: Worker, ready_fd: int):
+    stopping = threading.Event()
+
+    def on_stop(*_: object):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, on_stop)
+    # the supervisor decides when workers stop, ctrl-c only reaches it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    def ready():
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+
+    code = 0
+    try:
+        target(stopping, ready)
+    except BaseException as e:
+        print(f"worker {os.getpid()} crashed: {e!r}", file=sys.stderr)
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+class Supervisor:
+    """
+    Pre-forks `count` workers and keeps that many running.
+
+    SIGHUP replaces all workers gracefully: a new generation is started and
+    once it is listening the old workers get SIGTERM, stop accepting and exit
+    after finishing the connections they hold. SIGTERM or SIGINT stops all
+    workers the same way and then exits.
+    """
+
+    def __init__(self, count: int, target: Worker, graceful_timeout: float = 30.0):
+        self.count = count
+        self.target = target
+        self.graceful_timeout = graceful_timeout
+        self.workers: set[int] = set()
+        # old workers that were asked to stop, with their kill deadline
+        self.retiring: dict[int, float] = {}
+        self.reload_requested = False
+        self.stop_requested = False
+        self.last_restart = 0.0
+
+    def spawn(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            run_worker(self.target, write_fd)
+        os.close(write_fd)
+        self.workers.add(pid)
+        return pid, read_fd
+
+    def spawn_many(self, count: int):
+        """Forks `count` workers and waits until each of them is listening."""
+        pending = dict(self.spawn() for _ in range(count))
+        deadline = time.monotonic() + READY_TIMEOUT
+        ready: list[int] = []
+        while pending and (timeout := deadline - time.monotonic()) > 0:
+            readable, _, _ = select.select(list(pending.values()), [], [], timeout)
+            for fd in readable:
+                pid = next(pid for pid, read_fd in pending.items() if read_fd == fd)
+                if os.read(fd, 1):
+                    ready.append(pid)
+                os.close(fd)
+                del pending[pid]
+        for fd in pending.values():
+            os.close(fd)
+        return ready
+
+    def retire(self, pids: set[int]):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.workers.discard(pid)
+            self.retiring[pid] = deadline
+            self.signal(pid, signal.SIGTERM)
+
+    def signal(self, pid: int, sig: signal.Signals):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.retiring:
+                del self.retiring[pid]
+            elif pid in self.workers:
+                self.workers.discard(pid)
+                print(
+                    f"worker {pid} exited with status {os.waitstatus_to_exitcode(status)}"
+                )
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in self.retiring.items():
+            if now > deadline:
+                self.signal(pid, signal.SIGKILL)
+
+    def reload(self):
+        old = set(self.workers)
+        ready = self.spawn_many(self.count)
+        if len(ready) < self.count:
+            print("new workers failed to start, keeping the old ones")
+            self.retire(self.workers - old)
+            return
+        print(f"reloaded {len(old)} workers")
+        self.retire(old)
+
+    def run(self):
+        def on_reload(*_: object):
+            self.reload_requested = True
+
+        def on_stop(*_: object):
+            self.stop_requested = True
+
+        signal.signal(signal.SIGHUP, on_reload)
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+
+        self.spawn_many(self.count)
+        print(f"Supervisor {os.getpid()} started {len(self.workers)} workers")
+        while not self.stop_requested:
+            time.sleep(POLL_INTERVAL)
+            self.reap()
+            self.kill_overdue()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            elif (missing := self.count - len(self.workers)) and (
+                time.monotonic() - self.last_restart > RESTART_DELAY
+            ):
+                self.last_restart = time.monotonic()
+                self.spawn_many(missing)
+
+        self.retire(set(self.workers))
+        while self.retiring:
+            time.sleep(POLL_INTERVAL)
+            self.reap()
+            self.kill_overdue()
+        print("\nShutting down server")
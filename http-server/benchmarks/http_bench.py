@@ -0,0 +1,274 @@
+"""
+Load generator for the http-server routes.
+
+Runs every scenario for a fixed duration with `--concurrency` client threads
+and reports requests per second and p50/p99 latency. Results can be written as
+JSON and compared against an earlier run:
+
+    python -m benchmarks.http_bench --output before.json
+    python -m benchmarks.http_bench --baseline before.json
+
+The server has to be running with `--directory` for the /files scenarios. The
+client is pure Python, so on a small machine it can saturate before the server
+does; compare runs made on the same machine with the same settings.
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from app import constants
+
+
+CRLF = constants.CRLF.encode()
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    headers: dict[str, str] = field(default_factory=dict[str, str])
+    body: bytes = b""
+
+
+@dataclass
+class Result:
+    scenario: str
+    requests: int
+    errors: int
+    rps: float
+    p50_ms: float
+    p99_ms: float
+    mean_ms: float
+
+
+def scenarios(file_size: int):
+    upload = os.urandom(file_size)
+    return [
+        Scenario("index", "GET", "/"),
+        Scenario("echo", "GET", "/echo/benchmark"),
+        Scenario(
+            "echo-gzip", "GET", "/echo/benchmark", {"Accept-Encoding": "gzip"}
+        ),
+        Scenario("user-agent", "GET", "/user-agent", {"User-Agent": "http-bench"}),
+        Scenario("files-get", "GET", "/files/http_bench.bin"),
+        Scenario("files-post", "POST", "/files/http_bench_upload.bin", body=upload),
+    ]
+
+
+def encode_request(scenario: Scenario, host: str, keep_alive: bool):
+    headers = {
+        "Host": host,
+        "Connection": "keep-alive" if keep_alive else "close",
+        **scenario.headers,
+    }
+    if scenario.method == "POST":
+        headers["Content-Length"] = str(len(scenario.body))
+    lines = [f"{scenario.method} {scenario.path} HTTP/1.1"]
+    lines += [f"{key}: {value}" for key, value in headers.items()]
+    return (constants.CRLF.join(lines) + constants.CRLF * 2).encode() + scenario.body
+
+
+class Client:
+    """A single connection that reads responses framed by Content-Length or chunks."""
+
+    def __init__(self, address: tuple[str, int]):
+        self.address = address
+        self.conn: socket.socket | None = None
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+        self.conn = None
+        self.buffer.clear()
+
+    def recv(self):
+        data = self.conn.recv(64 * 1024)  # type: ignore
+        if not data:
+            raise ConnectionError("connection closed mid response")
+        self.buffer += data
+
+    def read_until(self, delimiter: bytes):
+        while (end := self.buffer.find(delimiter)) == -1:
+            self.recv()
+        data = bytes(self.buffer[:end])
+        del self.buffer[: end + len(delimiter)]
+        return data
+
+    def read_exactly(self, size: int):
+        while len(self.buffer) < size:
+            self.recv()
+        del self.buffer[:size]
+
+    def request(self, payload: bytes):
+        """Sends one request and returns its status and whether the server closed."""
+        if self.conn is None:
+            self.conn = socket.create_connection(self.address)
+        self.conn.sendall(payload)
+        head = self.read_until(CRLF * 2).decode("latin-1").split(constants.CRLF)
+        status = int(head[0].split(" ")[1])
+        headers = {
+            key.lower(): value
+            for key, _, value in (line.partition(": ") for line in head[1:])
+        }
+        if headers.get("transfer-encoding") == "chunked":
+            while size := int(self.read_until(CRLF), 16):
+                self.read_exactly(size + len(CRLF))
+            self.read_until(CRLF)
+        else:
+            self.read_exactly(int(headers.get("content-length", 0)))
+        closed = headers.get("connection", "").lower() == "close"
+        return status, closed
+
+
+def run_scenario(
+    scenario: Scenario,
+    address: tuple[str, int],
+    concurrency: int,
+    duration: float,
+    keep_alive: bool,
+):
+    payload = encode_request(scenario, f"{address[0]}:{address[1]}", keep_alive)
+    latencies: list[list[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.perf_counter() + duration
+
+    def worker(index: int):
+        client = Client(address)
+        samples = latencies[index]
+        while (start := time.perf_counter()) < deadline:
+            try:
+                status, closed = client.request(payload)
+            except (OSError, ValueError, IndexError):
+                errors[index] += 1
+                client.close()
+                continue
+            samples.append(time.perf_counter() - start)
+            if status >= 400:
+                errors[index] += 1
+            if closed or not keep_alive:
+                client.close()
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(sample for worker in latencies for sample in worker)
+    if not samples:
+        return Result(scenario.name, 0, sum(errors), 0.0, 0.0, 0.0, 0.0)
+
+    def percentile(p: float):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+    return Result(
+        scenario=scenario.name,
+        requests=len(samples),
+        errors=sum(errors),
+        rps=len(samples) / elapsed,
+        p50_ms=percentile(0.50),
+        p99_ms=percentile(0.99),
+        mean_ms=sum(samples) / len(samples) * 1000,
+    )
+
+
+def print_results(results: list[Result], baseline: dict[str, dict[str, float]]):
+    print(
+        f"{'scenario':<12} {'requests':>9} {'errors':>7} {'rps':>10}"
+        f" {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for result in results:
+        line = (
+            f"{result.scenario:<12} {result.requests:>9} {result.errors:>7}"
+            f" {result.rps:>10.1f} {result.p50_ms:>8.3f} {result.p99_ms:>8.3f}"
+        )
+        before = baseline.get(result.scenario)
+        if before and before["rps"] and before["p99_ms"]:
+            line += (
+                f"   rps {(result.rps / before['rps'] - 1) * 100:+.1f}%"
+                f" p99 {(result.p99_ms / before['p99_ms'] - 1) * 100:+.1f}%"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=4221)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="seconds per scenario"
+    )
+    parser.add_argument(
+        "--keep-alive",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="reuse connections between requests",
+    )
+    parser.add_argument(
+        "--file-size", type=int, default=64 * 1024, help="bytes per /files request"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        help="only run the named scenario, may be repeated",
+    )
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare")
+    args = parser.parse_args()
+
+    address = (args.host, args.port)
+    available = scenarios(args.file_size)
+    selected = [s for s in available if not args.scenario or s.name in args.scenario]
+    # the GET scenario needs a file to read
+    upload = next(s for s in available if s.name == "files-post")
+    setup = Scenario("setup", "POST", "/files/http_bench.bin", body=upload.body)
+    setup_client = Client(address)
+    status, _ = setup_client.request(encode_request(setup, args.host, keep_alive=False))
+    setup_client.close()
+    if status != 201:
+        parser.error(f"could not create the /files fixture, server answered {status}")
+
+    results = [
+        run_scenario(s, address, args.concurrency, args.duration, args.keep_alive)
+        for s in selected
+    ]
+
+    baseline: dict[str, dict[str, float]] = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "config": {
+                "host": args.host,
+                "port": args.port,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "keep_alive": args.keep_alive,
+                "file_size": args.file_size,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "timestamp": time.time(),
+            },
+            "results": [asdict(result) for result in results],
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Micro-benchmark for response serialization.
+
+Compares the old f-string `Response.build` (format the head as `str`, encode
+it, then join it with the body) against the bytes-native serializer that hands
+separate head and body buffers to `sendmsg`.
+
+    python -m benchmarks.response_serialization
+"""
+
+import argparse
+import socket
+import threading
+import time
+import tracemalloc
+from typing import Callable
+from app import constants, response, utils
+
+
+def legacy_build(res: response.Response):
+    header = res.header
+    headers = (
+        constants.CRLF.join([f"{key}: {value}" for key, value in header.dict().items()])
+        if header
+        else ""
+    )
+    head = f"{res.version} {res.status} {res.reason_phrase}{constants.CRLF}{headers}{constants.CRLF}{constants.CRLF}"
+    if type(res.body) is str:
+        head += f"{res.body}"
+    if type(res.body) is bytes:
+        return b"".join([head.encode(), res.body])
+    return head.encode()
+
+
+def legacy_send(conn: socket.socket, res: response.Response):
+    conn.sendall(legacy_build(res))
+
+
+def sendmsg_send(conn: socket.socket, res: response.Response):
+    utils.send_buffers(conn, res.buffers())
+
+
+def make_response(body_size: int):
+    body = b"x" * body_size
+    return response.Response(
+        200,
+        "OK",
+        header=response.Header(constants.ContentType.plain, len(body)),
+        body=body,
+    )
+
+
+def cpu_time(func: Callable[[], object], iterations: int):
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+
+def peak_allocation(func: Callable[[], object]):
+    """Largest amount of memory allocated while serializing one response."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def write_throughput(
+    send: Callable[[socket.socket, response.Response], None],
+    res: response.Response,
+    iterations: int,
+):
+    """CPU seconds per response for serializing and writing it to a socketpair."""
+    writer, reader = socket.socketpair()
+    expected = len(res.build()) * iterations
+
+    def drain():
+        received = 0
+        while received < expected:
+            received += len(reader.recv(1 << 20))
+
+    thread = threading.Thread(target=drain)
+    thread.start()
+    start = time.process_time()
+    for _ in range(iterations):
+        send(writer, res)
+    thread.join()
+    elapsed = time.process_time() - start
+    writer.close()
+    reader.close()
+    return elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(
+        f"{'body':>10} {'impl':>8} {'build us':>10} {'write us':>10} {'peak alloc':>12}"
+    )
+    for body_size in (16, 4 * 1024, 1024 * 1024):
+        res = make_response(body_size)
+        iterations = max(args.iterations * 16 // (16 + body_size // 1024), 50)
+        for name, build, send in (
+            ("legacy", lambda: legacy_build(res), legacy_send),
+            ("sendmsg", res.buffers, sendmsg_send),
+        ):
+            print(
+                f"{body_size:>10} {name:>8}"
+                f" {cpu_time(build, iterations) * 1e6:>10.2f}"
+                f" {write_throughput(send, res, iterations) * 1e6:>10.2f}"
+                f" {peak_allocation(build):>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()